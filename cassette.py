@@ -0,0 +1,176 @@
+"""Record/replay transport for upstream HTTP calls.
+
+All Polygon and LLM requests go through ``get``/``post`` here. Behaviour is
+controlled by environment variables:
+
+    POLYMCP_CASSETTE_MODE   off (default) | record | replay
+    POLYMCP_CASSETTE        cassette path (default: cassettes/default.jsonl.gz)
+    POLYMCP_REPLAY_SCALE    replay latency multiplier; 0 disables sleeping
+
+Cassettes are gzip-compressed JSON lines, one request/response pair per line.
+Recording overwrites the cassette: the first call recorded by a process
+truncates it, later calls from that process are appended. The background
+prefetcher is off in both record and replay mode, so cassettes only hold
+calls made on behalf of a request.
+API keys and Authorization headers are never written to disk, and they are
+not part of the lookup key. In replay mode server.py skips its credential
+checks; webui/Streamlit still need LIARA_API_KEY set, but a dummy value will
+do. Everything else that shapes a request must match the recording:
+POLYGON_BASE_URL, LIARA_BASE_URL, OPENWEBUI_URL and LIARA_MODEL are part of
+the URL or JSON body a request is looked up by.
+
+Example (offline regression run):
+
+    POLYMCP_CASSETTE_MODE=record python run_harness.py AAPL
+    POLYMCP_CASSETTE_MODE=replay POLYMCP_REPLAY_SCALE=0 python run_harness.py AAPL
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Dict, Optional
+
+import requests
+
+logger = logging.getLogger("polymcp.cassette")
+
+# query parameters that carry credentials and must not reach the cassette
+_SECRET_PARAMS = {"apikey", "api_key", "token"}
+
+
+def _mode() -> str:
+    return os.getenv("POLYMCP_CASSETTE_MODE", "off").lower()
+
+
+def _path() -> str:
+    return os.getenv(
+        "POLYMCP_CASSETTE",
+        os.path.join(os.path.dirname(__file__), "cassettes", "default.jsonl.gz"),
+    )
+
+
+def is_replaying() -> bool:
+    return _mode() == "replay"
+
+
+def is_active() -> bool:
+    """True when requests are being recorded or replayed."""
+    return _mode() != "off"
+
+
+def _request_key(method: str, url: str, params: Optional[dict], body) -> str:
+    clean = sorted((k, str(v)) for k, v in (params or {}).items() if k.lower() not in _SECRET_PARAMS)
+    raw = json.dumps([method.upper(), url, clean, body], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """A set of recorded interactions, loaded lazily from disk."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._queues: Dict[str, deque] = defaultdict(deque)
+        self._last: Dict[str, dict] = {}
+        self._loaded = False
+        self._recording = False
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        if not os.path.exists(self.path):
+            raise RuntimeError(f"Cassette not found: {self.path}")
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._queues[entry["key"]].append(entry)
+        logger.info(f"📼 Loaded {sum(len(q) for q in self._queues.values())} interactions from {self.path}")
+
+    def record(self, entry: dict):
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            # the first write of a recording session replaces any older cassette;
+            # after that each append is its own gzip member, read back in order
+            mode = "at" if self._recording else "wt"
+            self._recording = True
+            with gzip.open(self.path, mode, encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    def next(self, key: str, method: str, url: str) -> dict:
+        """Return the next recorded response for key, repeating the last one when exhausted."""
+        with self._lock:
+            self._load()
+            queue = self._queues.get(key)
+            if queue:
+                self._last[key] = queue.popleft()
+            elif key not in self._last:
+                raise RuntimeError(f"No recorded interaction for {method} {url}")
+            return self._last[key]
+
+
+_cassettes: Dict[str, Cassette] = {}
+_cassettes_lock = threading.Lock()
+
+
+def _cassette() -> Cassette:
+    path = _path()
+    with _cassettes_lock:
+        if path not in _cassettes:
+            _cassettes[path] = Cassette(path)
+        return _cassettes[path]
+
+
+def _to_response(entry: dict, url: str) -> requests.Response:
+    resp = requests.Response()
+    resp.status_code = entry["status"]
+    resp._content = entry["body"].encode("utf-8")
+    resp.encoding = "utf-8"
+    resp.headers["Content-Type"] = entry.get("content_type", "application/json")
+    resp.url = url
+    return resp
+
+
+def request(method: str, url: str, params: dict = None, json_body=None, **kwargs) -> requests.Response:
+    """Drop-in for ``requests.request`` that records or replays per the current mode."""
+    mode = _mode()
+    if mode == "off":
+        return requests.request(method, url, params=params, json=json_body, **kwargs)
+
+    key = _request_key(method, url, params, json_body)
+    if mode == "replay":
+        entry = _cassette().next(key, method, url)
+        scale = float(os.getenv("POLYMCP_REPLAY_SCALE", "1"))
+        if scale > 0:
+            time.sleep(entry["elapsed"] * scale)
+        return _to_response(entry, url)
+
+    if mode != "record":
+        raise RuntimeError(f"Unknown POLYMCP_CASSETTE_MODE: {mode}")
+
+    start = time.perf_counter()
+    resp = requests.request(method, url, params=params, json=json_body, **kwargs)
+    elapsed = time.perf_counter() - start
+    _cassette().record({
+        "key": key,
+        "method": method.upper(),
+        "url": url,
+        "status": resp.status_code,
+        "content_type": resp.headers.get("Content-Type", "application/json"),
+        "body": resp.text,
+        "elapsed": round(elapsed, 4),
+    })
+    return resp
+
+
+def get(url: str, params: dict = None, **kwargs) -> requests.Response:
+    return request("GET", url, params=params, **kwargs)
+
+
+def post(url: str, json: dict = None, **kwargs) -> requests.Response:
+    return request("POST", url, json_body=json, **kwargs)
@@ -0,0 +1,60 @@
+"""Shape-preserving downsampling for price series."""
+import numpy as np
+
+
+def lttb(x, y, n_out: int):
+    """Largest-Triangle-Three-Buckets: keep n_out points that preserve the visual shape.
+
+    The first and last points are always kept; each bucket in between
+    contributes the point forming the largest triangle with the previously
+    selected point and the average of the next bucket.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return x, y
+
+    # n_out - 2 buckets over the interior points [1, n - 1)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    idx = np.empty(n_out, dtype=int)
+    idx[0], idx[-1] = 0, n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # the bucket after the last one is just the final point
+        nhi = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[hi:nhi].mean()
+        avg_y = y[hi:nhi].mean()
+        area = np.abs(
+            (x[a] - avg_x) * (y[lo:hi] - y[a])
+            - (x[a] - x[lo:hi]) * (avg_y - y[a])
+        )
+        a = lo + int(area.argmax())
+        idx[i + 1] = a
+
+    return x[idx], y[idx]
+
+
+def minmax(x, y, n_out: int):
+    """Keep the min and max of each bucket, in time order (about n_out points)."""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if n_out >= n or n_out < 4:
+        return x, y
+
+    buckets = (n_out - 2) // 2
+    edges = np.linspace(1, n - 1, buckets + 1).astype(int)
+    keep = [0]
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        if hi <= lo:
+            continue
+        seg = y[lo:hi]
+        keep.extend(sorted((lo + int(seg.argmin()), lo + int(seg.argmax()))))
+    keep.append(n - 1)
+
+    # argmin and argmax coincide in flat buckets
+    idx = np.unique(np.asarray(keep))
+    return x[idx], y[idx]
@@ -0,0 +1,112 @@
+"""Bounded chat history with older turns spilled to disk in fixed-size pages."""
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+import weakref
+from collections import deque
+from typing import List
+
+HISTORY_WINDOW = int(os.getenv("HISTORY_WINDOW", "40"))
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+HISTORY_DIR = os.getenv("HISTORY_DIR", os.path.join(tempfile.gettempdir(), "polymcp-history"))
+# session directories untouched for this long are removed by sweep_stale()
+HISTORY_MAX_AGE = float(os.getenv("HISTORY_MAX_AGE", str(24 * 3600)))
+
+logger = logging.getLogger("polymcp.history")
+
+
+def sweep_stale(directory: str = HISTORY_DIR, max_age: float = HISTORY_MAX_AGE):
+    """Delete session directories not modified within max_age seconds.
+
+    Covers sessions whose ChatHistory was never garbage-collected, e.g.
+    after a crash or a hard restart of the Streamlit server.
+    """
+    cutoff = time.time() - max_age
+    try:
+        sessions = list(os.scandir(directory))
+    except FileNotFoundError:
+        return
+    for entry in sessions:
+        try:
+            if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                logger.info(f"🧹 Removed stale chat history {entry.name}")
+        except OSError:
+            continue
+
+
+class ChatHistory:
+    """Keeps at most ``window`` recent messages in memory.
+
+    When the window overflows, the oldest ``page_size`` messages are written
+    to page file N (0 = oldest) and dropped from memory. Earlier pages are
+    only read back when the user asks for them, so the per-rerun cost
+    depends on what is shown, not on how long the session has been running.
+    The page directory is deleted when the history object is garbage-collected
+    (i.e. when its Streamlit session ends).
+    """
+
+    def __init__(self, session_id: str = None, window: int = HISTORY_WINDOW,
+                 page_size: int = HISTORY_PAGE_SIZE, directory: str = HISTORY_DIR):
+        if page_size < 1 or window < page_size:
+            raise ValueError("need 1 <= page_size <= window")
+        self.session_id = session_id or uuid.uuid4().hex
+        self.window = window
+        self.page_size = page_size
+        self.base_directory = directory
+        self.directory = os.path.join(directory, self.session_id)
+        self.recent = deque()
+        self.pages = 0
+        self.shown_pages = 0
+        sweep_stale(directory)
+        weakref.finalize(self, shutil.rmtree, self.directory, True)
+
+    def append(self, role: str, content: str):
+        self.recent.append({"role": role, "content": content})
+        if len(self.recent) > self.window:
+            self._spill()
+
+    def _spill(self):
+        # pages hold chat text and the parent sits in a shared temp dir: owner-only access
+        os.makedirs(self.base_directory, mode=0o700, exist_ok=True)
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        fd = os.open(self.page_path(self.pages), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, "w", encoding="utf-8") as f:
+            for _ in range(self.page_size):
+                f.write(json.dumps(self.recent.popleft(), ensure_ascii=False) + "\n")
+        # shown_pages stays put, so the loaded range slides: the new page appears
+        # right above the window and the oldest loaded page drops off screen
+        self.pages += 1
+
+    def page_path(self, index: int) -> str:
+        return os.path.join(self.directory, f"page_{index:06d}.jsonl")
+
+    @property
+    def has_earlier(self) -> bool:
+        return self.shown_pages < self.pages
+
+    def show_more(self):
+        """Reveal one more page of older messages."""
+        if self.has_earlier:
+            self.shown_pages += 1
+
+    def visible_pages(self) -> List[int]:
+        """Indices of the loaded earlier pages, oldest first."""
+        return list(range(self.pages - self.shown_pages, self.pages))
+
+    def __len__(self):
+        return self.pages * self.page_size + len(self.recent)
+
+
+def load_page(path: str) -> List[dict]:
+    """Read a spilled page; page files are never modified after being written."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        # swept while the session sat idle past HISTORY_MAX_AGE
+        return []
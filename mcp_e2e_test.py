@@ -11,7 +11,7 @@ print("Loaded server module")
 
 if hasattr(mod, "list_tools_handler"):
     try:
-        tools = mod.list_tools_handler(None)
+        tools = asyncio.run(mod.list_tools_handler())
         print("Tools listed:")
         for t in tools:
             print(f" - {t.name}: {t.description}")
@@ -23,12 +23,16 @@ else:
 async def run_math_tests():
     try:
         print("Calling math_op (mul 3*4)")
-        res = await mod.math_op("math_op", {"operation": "mul", "a": 3, "b": 4})
-        print("Result:", res)
+        res = await mod.call_tool_handler("math_op", {"operation": "mul", "a": 3, "b": 4})
+        print("Result:", res.structuredContent)
 
         print("Calling math_op (div 10/2)")
-        res = await mod.math_op("math_op", {"operation": "div", "a": 10, "b": 2})
-        print("Result:", res)
+        res = await mod.call_tool_handler("math_op", {"operation": "div", "a": 10, "b": 2})
+        print("Result:", res.structuredContent)
+
+        print("Calling math_op with a bad operation")
+        res = await mod.call_tool_handler("math_op", {"operation": "pow", "a": 2, "b": 3})
+        print("Error:", res.isError, res.content[0].text)
     except Exception as e:
         print("math_op error:", e)
 
@@ -0,0 +1,344 @@
+"""Price cache with popularity-driven background prefetch."""
+import heapq
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from ratelimit import CallBudget, RateLimited, acquire_process_lock
+
+logger = logging.getLogger("polymcp.prefetch")
+
+# default TTL; prev-day aggregates only change once a day
+PRICE_CACHE_TTL = float(os.getenv("PRICE_CACHE_TTL", "3600"))
+PRICE_CACHE_MAX_ENTRIES = int(os.getenv("PRICE_CACHE_MAX_ENTRIES", "256"))
+PREFETCH_LEAD = float(os.getenv("PREFETCH_LEAD", "300"))
+PREFETCH_TOP_K = int(os.getenv("PREFETCH_TOP_K", "10"))
+PREFETCH_HALF_LIFE = float(os.getenv("PREFETCH_HALF_LIFE", "600"))
+# unpinned keys whose decayed hit count drops below this are left to expire
+PREFETCH_MIN_SCORE = float(os.getenv("PREFETCH_MIN_SCORE", "0.5"))
+# entries cached for less than this are never prefetched: refreshing them would be polling
+PREFETCH_MIN_TTL = float(os.getenv("PREFETCH_MIN_TTL", "300"))
+# self-pacing on top of the shared budget, which only admits prefetches into spare slots
+PREFETCH_MAX_CALLS_PER_MIN = float(os.getenv("PREFETCH_MAX_CALLS_PER_MIN", "3"))
+# only one process per host runs the prefetcher
+PREFETCH_LOCK_FILE = os.getenv("PREFETCH_LOCK_FILE", os.path.join(tempfile.gettempdir(), "polymcp-prefetch.lock"))
+
+
+class PopularityTracker:
+    """Exponentially decayed hit counts per key.
+
+    Scores are stored relative to a fixed epoch and scaled up as time passes,
+    so recording a hit is O(1) and nothing has to be rescanned to decay.
+    At most ``max_keys`` keys are tracked; past that the weaker half is dropped.
+    """
+
+    def __init__(self, half_life: float = PREFETCH_HALF_LIFE, max_keys: int = 4 * PRICE_CACHE_MAX_ENTRIES):
+        self._rate = math.log(2) / half_life
+        self._epoch = time.monotonic()
+        self._scores: Dict[Hashable, float] = {}
+        self._max_keys = max_keys
+        self._lock = threading.Lock()
+
+    def record(self, key: Hashable, weight: float = 1.0):
+        inc = weight * math.exp(self._rate * (time.monotonic() - self._epoch))
+        with self._lock:
+            self._scores[key] = self._scores.get(key, 0.0) + inc
+            # rebase before the growing weights overflow a float
+            if inc > 1e200:
+                self._rebase()
+            if len(self._scores) > self._max_keys:
+                keep = heapq.nlargest(self._max_keys // 2, self._scores.items(), key=lambda kv: kv[1])
+                self._scores = dict(keep)
+
+    def forget(self, key: Hashable):
+        with self._lock:
+            self._scores.pop(key, None)
+
+    def _rebase(self):
+        now = time.monotonic()
+        factor = math.exp(-self._rate * (now - self._epoch))
+        self._scores = {k: v * factor for k, v in self._scores.items() if v * factor > 1e-6}
+        self._epoch = now
+
+    def score(self, key: Hashable) -> float:
+        factor = math.exp(-self._rate * (time.monotonic() - self._epoch))
+        with self._lock:
+            return self._scores.get(key, 0.0) * factor
+
+    def top(self, k: int) -> List[Hashable]:
+        with self._lock:
+            return [key for key, _ in heapq.nlargest(k, self._scores.items(), key=lambda kv: kv[1])]
+
+
+class EvictedError(KeyError):
+    """The key has no cached entry or pinned loader left to refresh it with."""
+
+
+class PriceCache:
+    """Bounded LRU + TTL cache that remembers how to reload each entry.
+
+    Only successful fetches are stored, together with their loader. Evicting
+    an entry drops its loader and its popularity score, so unknown or failing
+    keys can't grow memory. Pinned keys (see ``register``) are never evicted.
+    Each entry may carry its own TTL; ``ttl`` is the default. Concurrent
+    misses and refreshes of one key share a single loader call.
+    """
+
+    def __init__(self, ttl: float = PRICE_CACHE_TTL, tracker: Optional[PopularityTracker] = None,
+                 max_entries: int = PRICE_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.tracker = tracker or PopularityTracker()
+        self.max_entries = max_entries
+        # key -> (expires_at, value, loader, ttl), least recently used first
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._pinned: Dict[Hashable, Callable[[], Any]] = {}
+        # key -> Future of the load currently running for it
+        self._inflight: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, loader: Callable[[], Any], ttl: Optional[float] = None):
+        """Return the cached value for key, calling loader on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                self._entries.move_to_end(key)
+        if entry and entry[0] > time.monotonic():
+            self.tracker.record(key)
+            return entry[1]
+        logger.info(f"🥶 Cold fetch for {key}")
+        value = self._load(key, loader, ttl)
+        self.tracker.record(key)
+        return value
+
+    def refresh(self, key: Hashable):
+        """Reload key with its known loader and store the result.
+
+        Raises EvictedError if the key was evicted and isn't pinned.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            loader = entry[2] if entry else self._pinned.get(key)
+            ttl = entry[3] if entry else None
+        if loader is None:
+            raise EvictedError(key)
+        return self._load(key, loader, ttl)
+
+    def _load(self, key: Hashable, loader: Callable[[], Any], ttl: Optional[float]):
+        """Run loader for key, or wait for the load another thread already started."""
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            value = loader()
+            self._store(key, value, loader, ttl)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def _store(self, key: Hashable, value: Any, loader: Callable[[], Any], ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        evicted = []
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value, loader, ttl)
+            if len(self._entries) > self.max_entries:
+                for old in list(self._entries):
+                    if len(self._entries) <= self.max_entries:
+                        break
+                    if old != key and old not in self._pinned:
+                        del self._entries[old]
+                        evicted.append(old)
+        for old in evicted:
+            self.tracker.forget(old)
+
+    def register(self, key: Hashable, loader: Callable[[], Any]):
+        """Pin key: keep its loader and entry regardless of LRU order."""
+        with self._lock:
+            self._pinned.setdefault(key, loader)
+
+    def has_loader(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries or key in self._pinned
+
+    def expires_in(self, key: Hashable) -> float:
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry[0] - time.monotonic() if entry else 0.0
+
+    def ttl_of(self, key: Hashable) -> float:
+        """TTL the key was last stored with (the default if it isn't cached)."""
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry[3] if entry else self.ttl
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class Prefetcher:
+    """Background thread keeping the hottest cache entries warm.
+
+    Pinned keys come first, then the decayed top-K keys by popularity that
+    are still scoring at least ``min_score`` and were cached for at least
+    ``min_ttl``. The list is cut to what ``max_calls_per_min`` can refresh
+    once per TTL; keys past that are left to expire rather than spreading
+    the budget so thin that the pinned ones go cold. A kept key is reloaded
+    once it expires within ``lead`` seconds, which should exceed the pacing
+    interval.
+
+    Refreshes run inside ``budget.background()``: they only take a slot of
+    the shared Polygon budget while user-facing calls leave room, and a
+    refused slot just ends the cycle.
+    """
+
+    def __init__(
+        self,
+        cache: PriceCache,
+        top_k: int = PREFETCH_TOP_K,
+        lead: float = PREFETCH_LEAD,
+        max_calls_per_min: float = PREFETCH_MAX_CALLS_PER_MIN,
+        budget: Optional[CallBudget] = None,
+        min_score: float = PREFETCH_MIN_SCORE,
+        min_ttl: float = PREFETCH_MIN_TTL,
+        lock_file: Optional[str] = PREFETCH_LOCK_FILE,
+    ):
+        self.cache = cache
+        self.top_k = top_k
+        self.lead = lead
+        self.min_interval = 60.0 / max_calls_per_min if max_calls_per_min > 0 else 0.0
+        self.budget = budget
+        self.min_score = min_score
+        self.min_ttl = min_ttl
+        self.lock_file = lock_file
+        self.pinned: List[Hashable] = []
+        self._last_call = 0.0
+        self._throttled = False
+        self._failed: Dict[Hashable, float] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock_handle = None
+
+    def pin(self, key: Hashable, loader: Callable[[], Any]):
+        """Always keep key warm, regardless of its popularity."""
+        self.cache.register(key, loader)
+        if key not in self.pinned:
+            self.pinned.append(key)
+
+    def capacity(self) -> Optional[int]:
+        """How many keys the call budget can refresh once per TTL (None = unlimited)."""
+        if not self.min_interval:
+            return None
+        # strictly fewer than ttl / interval, or a key's slot lands right on its expiry
+        return max(1, math.ceil(self.cache.ttl / self.min_interval) - 1)
+
+    def candidates(self) -> List[Hashable]:
+        """Keys to keep warm, highest priority first."""
+        keys = list(self.pinned)
+        tracker = self.cache.tracker
+        for key in tracker.top(self.top_k):
+            if (key not in keys and self.cache.has_loader(key)
+                    and tracker.score(key) >= self.min_score
+                    and self.cache.ttl_of(key) >= self.min_ttl):
+                keys.append(key)
+        capacity = self.capacity()
+        if capacity is not None:
+            keys = keys[:capacity]
+        return keys
+
+    def run_once(self) -> int:
+        """Refresh due entries; returns the number of upstream calls made."""
+        calls = 0
+        self._throttled = False
+        for key in self.candidates():
+            if self._stop.is_set():
+                break
+            if self.cache.expires_in(key) > self.lead:
+                continue
+            # back off from keys whose last refresh failed
+            if time.monotonic() - self._failed.get(key, -math.inf) < self.lead:
+                continue
+            wait = self._last_call + self.min_interval - time.monotonic()
+            if wait > 0 and self._stop.wait(wait):
+                break
+            previous, self._last_call = self._last_call, time.monotonic()
+            try:
+                self._refresh(key)
+            except RateLimited:
+                # foreground traffic is using the budget; not the key's fault
+                self._last_call = previous
+                self._throttled = True
+                break
+            except EvictedError:
+                # evicted since candidates() was taken; nothing left to refresh
+                self._last_call = previous
+                continue
+            except Exception as e:
+                calls += 1
+                self._failed[key] = time.monotonic()
+                logger.warning(f"⚠️ Prefetch failed for {key}: {e}")
+            else:
+                calls += 1
+                self._failed.pop(key, None)
+                logger.info(f"🔥 Prefetched {key}")
+        return calls
+
+    def _refresh(self, key: Hashable):
+        if self.budget is None:
+            return self.cache.refresh(key)
+        with self.budget.background():
+            return self.cache.refresh(key)
+
+    def _next_wakeup(self) -> float:
+        if self._throttled:
+            # retry once the budget has had time to free a slot
+            return max(self.min_interval, 1.0)
+        # wake when the soonest kept key enters its refresh window
+        due = [self.cache.expires_in(key) - self.lead for key in self.candidates()]
+        soonest = min(due, default=self.lead)
+        return min(max(soonest, 0.05), max(self.lead / 2, 0.05))
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self._next_wakeup())
+
+    def start(self) -> bool:
+        """Start the thread unless another process already runs a prefetcher."""
+        if self._thread and self._thread.is_alive():
+            return True
+        if self.lock_file and self._lock_handle is None:
+            self._lock_handle = acquire_process_lock(self.lock_file)
+            if self._lock_handle is None:
+                logger.info("💤 Prefetcher already running in another process")
+                return False
+        capacity = self.capacity()
+        if capacity is not None and len(self.pinned) > capacity:
+            logger.warning(f"⚠️ Prefetch budget covers {capacity} keys but {len(self.pinned)} are pinned")
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="polymcp-prefetch", daemon=True)
+        self._thread.start()
+        logger.info(f"🚀 Prefetcher started (top_k={self.top_k}, lead={self.lead}s, capacity={capacity})")
+        return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        if self._lock_handle is not None:
+            self._lock_handle.close()
+            self._lock_handle = None
@@ -0,0 +1,127 @@
+"""Polygon call budget shared by every process on the host."""
+import contextlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; the budget is then per process
+    fcntl = None
+
+logger = logging.getLogger("polymcp.ratelimit")
+
+# Polygon's free tier allows 5 calls/minute; 0 disables the budget (paid plans)
+POLYGON_CALLS_PER_MIN = int(os.getenv("POLYGON_CALLS_PER_MIN", "5"))
+# slots background work must leave free for user-facing calls
+POLYGON_BACKGROUND_RESERVE = int(os.getenv("POLYGON_BACKGROUND_RESERVE", "2"))
+# longest a user-facing call waits for a slot before giving up
+POLYGON_RATE_WAIT = float(os.getenv("POLYGON_RATE_WAIT", "30"))
+POLYGON_RATE_FILE = os.getenv(
+    "POLYGON_RATE_FILE", os.path.join(tempfile.gettempdir(), "polymcp-polygon-calls.json")
+)
+
+WINDOW = 60.0
+
+
+class RateLimited(RuntimeError):
+    """No call slot is available within the allowed wait."""
+
+
+class CallBudget:
+    """Sliding one-minute window of upstream calls.
+
+    The call timestamps live in a small file guarded by ``flock``, so the
+    stdio server, the webui and Streamlit all draw from the same budget.
+    User-facing calls wait for a slot; calls made inside ``background()``
+    are only admitted while ``reserve`` slots stay free and never wait.
+    """
+
+    def __init__(self, calls_per_min: int = POLYGON_CALLS_PER_MIN, path: str = POLYGON_RATE_FILE,
+                 reserve: int = POLYGON_BACKGROUND_RESERVE, max_wait: float = POLYGON_RATE_WAIT):
+        self.limit = calls_per_min
+        self.path = path
+        self.reserve = reserve
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._calls = []  # used when fcntl isn't available
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def background(self):
+        """Mark calls made by this thread inside the block as low priority."""
+        previous = getattr(self._local, "background", False)
+        self._local.background = True
+        try:
+            yield
+        finally:
+            self._local.background = previous
+
+    def acquire(self):
+        """Take a call slot, waiting (foreground) or raising RateLimited (background)."""
+        if self.limit <= 0:
+            return
+        background = getattr(self._local, "background", False)
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            delay = self._try_take(self.reserve if background else 0)
+            if delay == 0:
+                return
+            if background:
+                raise RateLimited("no spare Polygon budget for background work")
+            if time.monotonic() + delay > deadline:
+                raise RateLimited("Polygon call budget exhausted")
+            logger.info(f"⏳ Polygon budget full, waiting {delay:.1f}s")
+            time.sleep(delay)
+
+    def _try_take(self, reserve: int) -> float:
+        """Record a call and return 0, or return how long until a slot frees up."""
+        with self._lock, self._state() as calls:
+            now = time.time()
+            calls[:] = [t for t in calls if t > now - WINDOW]
+            if len(calls) + reserve < self.limit:
+                calls.append(now)
+                return 0.0
+            # the call whose expiry brings us back under the limit
+            oldest = calls[len(calls) + reserve - self.limit]
+            return max(oldest + WINDOW - now, 0.01)
+
+    @contextlib.contextmanager
+    def _state(self):
+        if fcntl is None:
+            yield self._calls
+            return
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        with os.fdopen(fd, "r+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                try:
+                    calls = [float(t) for t in json.loads(f.read() or "[]")]
+                except ValueError:
+                    calls = []
+                yield calls
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(calls))
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def acquire_process_lock(path: str):
+    """Try to take an exclusive lock held for the life of the process.
+
+    Returns the open lock file on success and None if another process holds
+    it. Without fcntl every process gets the lock.
+    """
+    f = open(path, "a+")
+    if fcntl is None:
+        return f
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
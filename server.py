@@ -1,11 +1,16 @@
 import os
-import requests
+import datetime
 from dotenv import load_dotenv
 from mcp.server import Server
 import re
+from urllib.parse import urlsplit, parse_qsl
 import mcp.types as types
 from mcp.types import TextContent, Completion
 import logging
+from prefetch import PriceCache, Prefetcher
+from ratelimit import CallBudget
+import cassette
+from tools import ToolRegistry
 
 load_dotenv()
 
@@ -19,10 +24,11 @@ logger = logging.getLogger("polymcp.server")
 POLY_API = os.getenv("POLYGON_API_KEY")
 BASE_URL = os.getenv("POLYGON_BASE_URL", "https://api.polygon.io")
 
-if not POLY_API:
+if not POLY_API and not cassette.is_replaying():
     raise ValueError("POLYGON_API_KEY not found in environment variables.")
 
 server = Server("polygon-mcp")
+registry = ToolRegistry()
 
 # math tool: mul/div
 math_input_schema = {
@@ -43,40 +49,69 @@ math_output_schema = {
     "additionalProperties": False,
 }
 
+# polygon tools
+price_input_schema = {
+    "type": "object",
+    "properties": {"ticker": {"type": "string", "minLength": 1}},
+    "required": ["ticker"],
+    "additionalProperties": False,
+}
+
+prev_close_input_schema = {
+    "type": "object",
+    "properties": {"symbol": {"type": "string", "minLength": 1}},
+    "required": ["symbol"],
+    "additionalProperties": False,
+}
+
+proxy_input_schema = {
+    "type": "object",
+    "properties": {
+        "path": {"type": "string", "minLength": 1},
+        "query": {"type": "object"},
+    },
+    "required": ["path"],
+    "additionalProperties": False,
+}
+
 
-@server.call_tool()
-async def math_op(tool_name: str, arguments: dict):
+@registry.tool("math_op", "Multiply or divide two numbers", math_input_schema, math_output_schema)
+async def math_op(operation: str, a: float, b: float):
     # supports mul/div
-    op = arguments.get("operation")
-    a = arguments.get("a")
-    b = arguments.get("b")
-    
-    logger.info(f"🧮 Math operation requested: {op} with a={a}, b={b}")
+    logger.info(f"🧮 Math operation requested: {operation} with a={a}, b={b}")
 
-    if op == "mul":
+    if operation == "mul":
         res = a * b
         logger.info(f"✅ Multiply result: {a} × {b} = {res}")
-    elif op == "div":
+    elif operation == "div":
         if b == 0:
             logger.error("❌ Division by zero attempted!")
             raise ValueError("division by zero")
         res = a / b
         logger.info(f"✅ Divide result: {a} ÷ {b} = {res}")
     else:
-        logger.error(f"❌ Unsupported operation: {op}")
-        raise ValueError(f"unsupported operation: {op}")
+        logger.error(f"❌ Unsupported operation: {operation}")
+        raise ValueError(f"unsupported operation: {operation}")
 
     logger.info(f"🎯 Math operation completed successfully: {res}")
     return {"result": res}
 
+# one Polygon quota for every process on the host (server.py, webui, Streamlit)
+polygon_budget = CallBudget()
+
+
 # polygon helper
 def polygon_get(path: str, params: dict = None):
     if params is None:
         params = {}
 
-    params["apiKey"] = POLY_API
+    if not cassette.is_replaying():
+        polygon_budget.acquire()
+
+    # key goes in a header so it never shows up in URLs, logs or exception text
+    headers = {"Authorization": f"Bearer {POLY_API}"}
     url = f"{BASE_URL}/{path.lstrip('/')}"
-    r = requests.get(url, params=params, timeout=10)
+    r = cassette.get(url, params=params, headers=headers, timeout=10)
 
     if r.status_code != 200:
         raise RuntimeError(f"Polygon API error {r.status_code}: {r.text}")
@@ -84,18 +119,104 @@ def polygon_get(path: str, params: dict = None):
     return r.json()
 
 
-@server.call_tool()
+# Polygon returns at most 50000 bars per page and each page is a call against the budget
+BARS_PAGE_LIMIT = 50000
+BARS_MAX_PAGES = int(os.getenv("BARS_MAX_PAGES", "3"))
+# rough bars per calendar day (crypto trades around the clock), coarsest last
+_BARS_PER_DAY = {"minute": 1440, "hour": 24, "day": 1, "week": 1 / 7, "month": 1 / 30}
+
+
+def fit_timespan(timespan: str, start: str, end: str, max_pages: int = BARS_MAX_PAGES) -> str:
+    """Return timespan, or the finest coarser one whose bars fit in max_pages pages."""
+    if timespan not in _BARS_PER_DAY:
+        return timespan
+    days = (datetime.date.fromisoformat(end) - datetime.date.fromisoformat(start)).days + 1
+    spans = list(_BARS_PER_DAY)
+    for span in spans[spans.index(timespan):]:
+        if days * _BARS_PER_DAY[span] <= max_pages * BARS_PAGE_LIMIT:
+            return span
+    return spans[-1]
+
+
+def get_bars(ticker: str, timespan: str, start: str, end: str, multiplier: int = 1,
+             max_pages: int = BARS_MAX_PAGES):
+    """Fetch aggregate bars for ticker between start and end (YYYY-MM-DD), following pagination.
+
+    At most max_pages pages are fetched; each one waits for a slot in the
+    shared Polygon budget. Use fit_timespan to pick a bar size that fits.
+    """
+    logger.info(f"📊 Bars request for {ticker}: {multiplier} {timespan} {start}..{end}")
+    path = f"v2/aggs/ticker/{ticker}/range/{multiplier}/{timespan}/{start}/{end}"
+    params = {"adjusted": "true", "sort": "asc", "limit": BARS_PAGE_LIMIT}
+    bars = []
+    for _ in range(max_pages):
+        data = polygon_get(path, params)
+        bars.extend(data.get("results") or [])
+        next_url = data.get("next_url")
+        if not next_url:
+            break
+        # next_url is absolute and carries the cursor in its query string
+        parts = urlsplit(next_url)
+        path, params = parts.path, dict(parse_qsl(parts.query))
+    else:
+        logger.warning(f"⚠️ Bars for {ticker} truncated after {max_pages} pages")
+    logger.info(f"✅ {len(bars)} bars retrieved for {ticker}")
+    return bars
+
+
+# last trades go stale quickly: cache them briefly and never prefetch them
+MARKET_DATA_TTL = float(os.getenv("MARKET_DATA_TTL", "60"))
+
+# shared price cache; the prefetcher keeps popular tickers warm
+price_cache = PriceCache()
+prefetcher = Prefetcher(price_cache, budget=polygon_budget)
+
+# tickers that dominate traffic (see extract_ticker in streamlit_app.py)
+HOT_TICKERS = [
+    t.strip()
+    for t in os.getenv("PREFETCH_HOT_TICKERS", "X:BTCUSD,X:ETHUSD,AAPL").split(",")
+    if t.strip()
+]
+
+
+def _fetch_prev(ticker: str):
+    return polygon_get(f"v2/aggs/ticker/{ticker}/prev", {"adjusted": "true"})
+
+
+def _fetch_market_data(ticker: str):
+    try:
+        return polygon_get(f"v1/last/crypto/{ticker}")
+    except Exception:
+        return polygon_get(f"v2/aggs/ticker/{ticker}/prev")
+
+
+def cached_prev(ticker: str):
+    return price_cache.get(("prev", ticker), lambda: _fetch_prev(ticker))
+
+
+def cached_market_data(ticker: str):
+    return price_cache.get(("market", ticker), lambda: _fetch_market_data(ticker), ttl=MARKET_DATA_TTL)
+
+
+def start_prefetcher():
+    """Pin the hot tickers and start the background prefetch thread."""
+    if cassette.is_active():
+        # background fetches would land in a recording at arbitrary points and,
+        # on replay, consume recorded responses out of order
+        logger.info("📼 Cassette mode: prefetcher disabled")
+        return
+    for t in HOT_TICKERS:
+        prefetcher.pin(("prev", t), lambda t=t: _fetch_prev(t))
+    prefetcher.start()
+
+
+@registry.tool("get_price", "Previous-day OHLC for a ticker (cached)", price_input_schema)
 def get_price(ticker: str):
     """Get current price for ticker"""
     logger.info(f"📈 Price request for ticker: {ticker}")
     
-    url = f"{BASE_URL}/v2/aggs/ticker/{ticker}/prev"
-    params = {"adjusted": "true", "apikey": POLY_API}
-    
     try:
-        logger.info(f"🌐 Making API call to Polygon.io for {ticker}")
-        r = requests.get(url, params=params)
-        response_data = r.json()
+        response_data = cached_prev(ticker)
         
         # Extract price info for logging
         if 'results' in response_data and response_data['results']:
@@ -108,7 +229,7 @@ def get_price(ticker: str):
         return TextContent(type="text", text=f"error: {e}")
 
 
-@server.call_tool()
+@registry.tool("proxy", "Raw GET against the Polygon REST API", proxy_input_schema)
 def proxy(path: str, query: dict = None):
     try:
         data = polygon_get(path, params=query)
@@ -117,7 +238,7 @@ def proxy(path: str, query: dict = None):
         return TextContent(type="text", text=f"Error: {e}")
 
 
-@server.call_tool()
+@registry.tool("get_prev_close", "Previous close for a symbol", prev_close_input_schema)
 def get_prev_close(symbol: str):
     try:
         data = polygon_get(f"v2/aggs/ticker/{symbol}/prev")
@@ -126,6 +247,18 @@ def get_prev_close(symbol: str):
         return TextContent(type="text", text=f"Error: {e}")
 
 
+@server.list_tools()
+async def list_tools_handler() -> list[types.Tool]:
+    return registry.list_tools()
+
+
+# inputs are checked by the registry's precompiled validators, not per call by the SDK
+@server.call_tool(validate_input=False)
+async def call_tool_handler(name: str, arguments: dict):
+    logger.info(f"🛠️ Tool call: {name}")
+    return await registry.call_tool_result(name, arguments)
+
+
 # LLM backend (Liara)
 
 # Read Liara/OpenAI-compatible endpoint and model from environment.
@@ -139,7 +272,7 @@ LIARA_MODEL = os.getenv("LIARA_MODEL", "openai/gpt-4o-mini")
 
 def _call_liara_chat(user_content: str) -> str:
     # call Liara chat endpoint
-    if not LIARA_API_KEY:
+    if not LIARA_API_KEY and not cassette.is_replaying():
         raise RuntimeError("LIARA_API_KEY not set in environment")
 
     url = f"{LIARA_BASE_URL.rstrip('/')}/chat/completions"
@@ -154,7 +287,7 @@ def _call_liara_chat(user_content: str) -> str:
         "max_tokens": 512,
     }
 
-    r = requests.post(url, headers=headers, json=payload, timeout=20)
+    r = cassette.post(url, headers=headers, json=payload, timeout=20)
     if r.status_code >= 400:
         raise RuntimeError(f"LLM request failed {r.status_code}: {r.text}")
 
@@ -187,7 +320,7 @@ def _call_openwebui(prompt: str) -> str:
     for ep in endpoints:
         url = OPENWEBUI_URL.rstrip("/") + ep
         try:
-            response = requests.post(url, headers=headers, json=payload, timeout=20)
+            response = cassette.post(url, headers=headers, json=payload, timeout=20)
             response.raise_for_status()
             return response.json().get("text", "")
         except Exception as e:
@@ -226,19 +359,8 @@ def provide_completion(ref, argument, context):
     market_context_lines = []
     for t in tickers:
         try:
-            # fetch market data
-            data = None
-            if ":" in t or t.startswith("X:") or t.upper().endswith("USD"):
-                # Use proxy style path for crypto pairs: X:BTCUSD
-                try:
-                    data = polygon_get(f"v1/last/crypto/{t}")
-                except Exception:
-                    data = polygon_get(f"v2/aggs/ticker/{t}/prev")
-            else:
-                try:
-                    data = polygon_get(f"v1/last/crypto/{t}")
-                except Exception:
-                    data = polygon_get(f"v2/aggs/ticker/{t}/prev")
+            # fetch market data (served from the price cache when warm)
+            data = cached_market_data(t)
 
             market_context_lines.append(f"{t}: {data}")
         except Exception as e:
@@ -276,6 +398,8 @@ if __name__ == "__main__":
     from mcp.server.models import InitializationOptions
 
     init_options = server.create_initialization_options()
+    if os.getenv("PREFETCH_ENABLED", "true").lower() in ("1", "true", "yes"):
+        start_prefetcher()
 
     async def _main():
         async with stdio_server() as (read_stream, write_stream):
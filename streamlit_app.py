@@ -1,12 +1,17 @@
 import streamlit as st
-import requests
+import cassette
 import os
 import json
 import asyncio
 import re
 import sys
 import logging
+import datetime
+import numpy as np
+import plotly.graph_objects as go
 sys.path.append('.')
+from downsample import lttb, minmax
+from history import ChatHistory, load_page
 
 
 logging.basicConfig(level=logging.INFO)
@@ -14,9 +19,20 @@ logger = logging.getLogger(__name__)
 
 
 import importlib.util
-spec = importlib.util.spec_from_file_location("mcp_server_module", "server.py")
-mod = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(mod)
+
+
+@st.cache_resource(show_spinner=False)
+def load_server_module():
+    # executed once per process instead of on every rerun
+    spec = importlib.util.spec_from_file_location("mcp_server_module", "server.py")
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    if os.getenv("PREFETCH_ENABLED", "true").lower() in ("1", "true", "yes"):
+        mod.start_prefetcher()
+    return mod
+
+
+mod = load_server_module()
 
 
 st.set_page_config(
@@ -101,22 +117,102 @@ def extract_ticker(text):
     return None
 
 
+CHART_TIMESPANS = ["minute", "hour", "day", "week"]
 
 
+@st.cache_data(ttl=300, show_spinner=False)
+def load_bars(ticker, timespan, start, end):
+    """Fetch bars as (timestamps_ms, closes) arrays; cached per range."""
+    bars = mod.get_bars(ticker, timespan, start.isoformat(), end.isoformat())
+    x = np.fromiter((b["t"] for b in bars), dtype=float, count=len(bars))
+    y = np.fromiter((b["c"] for b in bars), dtype=float, count=len(bars))
+    return x, y
 
-# Chat interface
-if "messages" not in st.session_state:
-    st.session_state.messages = []
 
-# Display chat messages
-for message in st.session_state.messages:
+@st.cache_data(max_entries=32, show_spinner=False)
+def downsample_bars(x, y, width, method):
+    if method == "LTTB":
+        return lttb(x, y, width)
+    return minmax(x, y, width)
+
+
+def render_price_chart(ticker):
+    """Chart view for the last ticker asked about, downsampled to the plot width."""
+    with st.expander(f"📊 {ticker} chart", expanded=True):
+        today = datetime.date.today()
+        col1, col2, col3 = st.columns(3)
+        date_range = col1.date_input(
+            "Range",
+            value=(today - datetime.timedelta(days=30), today),
+            max_value=today,
+            key="chart_range",
+        )
+        timespan = col2.selectbox("Bar size", CHART_TIMESPANS, index=1, key="chart_timespan")
+        method = col3.radio("Downsampling", ["LTTB", "Min/Max"], key="chart_method")
+        width = st.slider(
+            "Points (≈ plot width in px)", 200, 2000, 700, step=50, key="chart_width",
+            help="Streamlit doesn't report the chart's pixel width; more points than pixels add no detail.",
+        )
+
+        if not isinstance(date_range, tuple) or len(date_range) != 2:
+            st.info("Pick a start and end date")
+            return
+        start, end = date_range
+
+        # keep long ranges within a few paged calls of the rate-limited API
+        fitted = mod.fit_timespan(timespan, start.isoformat(), end.isoformat())
+        if fitted != timespan:
+            st.info(f"Showing {fitted} bars: {timespan} bars over this range need more than "
+                    f"{mod.BARS_MAX_PAGES} API calls")
+        try:
+            x, y = load_bars(ticker, fitted, start, end)
+        except Exception as e:
+            st.error(f"❌ Error loading bars: {e}")
+            return
+        if len(x) == 0:
+            st.warning("No bars in this range")
+            return
+
+        dx, dy = downsample_bars(x, y, width, method)
+        fig = go.Figure(go.Scattergl(x=dx.astype("datetime64[ms]"), y=dy, mode="lines", name=ticker))
+        fig.update_layout(height=350, margin=dict(l=10, r=10, t=30, b=10), title=f"{ticker} close")
+        st.plotly_chart(fig, use_container_width=True)
+        caption = f"{len(dx):,} of {len(x):,} bars plotted"
+        if len(x) >= mod.BARS_MAX_PAGES * mod.BARS_PAGE_LIMIT:
+            caption += " (range truncated; narrow it to see the rest)"
+        st.caption(caption)
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def load_history_page(path):
+    # spilled pages are immutable, so the path is a stable cache key
+    return load_page(path)
+
+
+def render_message(message):
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
 
+
+# Chat interface: only the recent window lives in memory, older turns are paged from disk
+if "history" not in st.session_state:
+    st.session_state.history = ChatHistory()
+history = st.session_state.history
+
+if history.has_earlier:
+    st.button("⬆️ Load earlier messages", on_click=history.show_more)
+
+# Display chat messages
+for page in history.visible_pages():
+    for message in load_history_page(history.page_path(page)):
+        render_message(message)
+for message in history.recent:
+    render_message(message)
+
 # Chat input
 if prompt := st.chat_input():
     # Add user message to chat history
-    st.session_state.messages.append({"role": "user", "content": prompt})
+    history.append("user", prompt)
     with st.chat_message("user"):
         st.markdown(prompt)
     
@@ -133,11 +229,7 @@ if prompt := st.chat_input():
                         a, b, operation = math_data
                         logger.info(f"Math question: {operation} {a} and {b}")
                         
-                        result = asyncio.run(mod.math_op("math_op", {
-                            "operation": operation, 
-                            "a": a, 
-                            "b": b
-                        }))
+                        result = asyncio.run(mod.math_op(operation, a, b))
                         
                         if operation == 'mul':
                             response = f"✅ **{a} × {b} = {result['result']}**"
@@ -145,11 +237,11 @@ if prompt := st.chat_input():
                             response = f"✅ **{a} ÷ {b} = {result['result']}**"
                             
                         st.success(response)
-                        st.session_state.messages.append({"role": "assistant", "content": response})
+                        history.append("assistant", response)
                     else:
                         error_msg = "❌ Sorry, I couldn't understand the math operation. Please try patterns like '5 × 3' or 'ضرب 10 در 2'"
                         st.error(error_msg)
-                        st.session_state.messages.append({"role": "assistant", "content": error_msg})
+                        history.append("assistant", error_msg)
                 
                 # Check if it's a price question
                 elif detect_price_question(prompt):
@@ -158,6 +250,7 @@ if prompt := st.chat_input():
                     ticker = extract_ticker(prompt)
                     if ticker:
                         logger.info(f"Price question for: {ticker}")
+                        st.session_state.chart_ticker = ticker
                         
                         result = mod.get_price(ticker)
                         price_text = result.text if hasattr(result, 'text') else str(result)
@@ -174,11 +267,11 @@ if prompt := st.chat_input():
                             response = f"💰 **{ticker}**: {price_text}"
                         
                         st.success(response)
-                        st.session_state.messages.append({"role": "assistant", "content": response})
+                        history.append("assistant", response)
                     else:
                         error_msg = "❌ Sorry, I couldn't identify the ticker symbol. Please try 'BTC', 'AAPL', or 'Bitcoin price'"
                         st.error(error_msg)
-                        st.session_state.messages.append({"role": "assistant", "content": error_msg})
+                        history.append("assistant", error_msg)
                 
                 # If neither math nor price, use Liara AI
                 else:
@@ -200,7 +293,7 @@ if prompt := st.chat_input():
                             "max_tokens": 512
                         }
                         
-                        response = requests.post(
+                        response = cassette.post(
                             f"{LIARA_BASE_URL}/chat/completions",
                             headers=headers,
                             json=payload,
@@ -211,18 +304,21 @@ if prompt := st.chat_input():
                             data = response.json()
                             ai_response = data["choices"][0]["message"]["content"]
                             st.markdown(ai_response)
-                            st.session_state.messages.append({"role": "assistant", "content": ai_response})
+                            history.append("assistant", ai_response)
                         else:
                             error_msg = f"❌ AI Error: {response.status_code}"
                             st.error(error_msg)
-                            st.session_state.messages.append({"role": "assistant", "content": error_msg})
+                            history.append("assistant", error_msg)
                     else:
                         error_msg = "❌ AI service not configured"
                         st.error(error_msg)
-                        st.session_state.messages.append({"role": "assistant", "content": error_msg})
+                        history.append("assistant", error_msg)
                         
             except Exception as e:
                 error_msg = f"❌ Error: {str(e)}"
                 st.error(error_msg)
-                st.session_state.messages.append({"role": "assistant", "content": error_msg})
+                history.append("assistant", error_msg)
 
+# Chart for the most recent price question
+if st.session_state.get("chart_ticker"):
+    render_price_chart(st.session_state.chart_ticker)
@@ -0,0 +1,128 @@
+"""Tool registry: one MCP call_tool entry point dispatching by name."""
+import asyncio
+import functools
+import inspect
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+import jsonschema
+from jsonschema.exceptions import best_match
+import mcp.types as types
+
+logger = logging.getLogger("polymcp.tools")
+
+TOOL_WORKERS = int(os.getenv("TOOL_WORKERS", "8"))
+
+
+def compile_schema(schema: dict):
+    """Check a JSON schema once and return a reusable validator for it."""
+    cls = jsonschema.validators.validator_for(schema)
+    cls.check_schema(schema)
+    return cls(schema)
+
+
+@dataclass
+class ToolSpec:
+    tool: types.Tool
+    func: Callable[..., Any]
+    is_async: bool
+    input_validator: Any
+    output_validator: Optional[Any] = None
+
+
+class ToolRegistry:
+    """Name -> handler table with precompiled argument/result validators.
+
+    Handlers take the tool arguments as keyword arguments. Coroutine
+    functions are awaited; plain functions run on a bounded thread pool so
+    blocking HTTP calls don't stall the event loop.
+    """
+
+    def __init__(self, max_workers: int = TOOL_WORKERS):
+        self._specs: Dict[str, ToolSpec] = {}
+        self._tools: List[types.Tool] = []
+        self._max_workers = max_workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def tool(self, name: str, description: str, input_schema: dict, output_schema: Optional[dict] = None):
+        """Register the decorated function as tool ``name``; the function is returned unchanged."""
+        def decorator(func):
+            if name in self._specs:
+                raise ValueError(f"tool already registered: {name}")
+            tool = types.Tool(
+                name=name,
+                description=description,
+                inputSchema=input_schema,
+                outputSchema=output_schema,
+            )
+            self._specs[name] = ToolSpec(
+                tool=tool,
+                func=func,
+                is_async=inspect.iscoroutinefunction(func),
+                input_validator=compile_schema(input_schema),
+                output_validator=compile_schema(output_schema) if output_schema else None,
+            )
+            self._tools.append(tool)
+            return func
+        return decorator
+
+    def list_tools(self) -> List[types.Tool]:
+        return list(self._tools)
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="polymcp-tool")
+        return self._pool
+
+    async def call(self, name: str, arguments: Optional[dict] = None):
+        """Validate arguments, run the handler and validate structured output."""
+        spec = self._specs.get(name)
+        if spec is None:
+            raise ValueError(f"unknown tool: {name}")
+        arguments = arguments or {}
+
+        if not spec.input_validator.is_valid(arguments):
+            error = best_match(spec.input_validator.iter_errors(arguments))
+            raise ValueError(f"Input validation error: {error.message}")
+
+        if spec.is_async:
+            result = await spec.func(**arguments)
+        else:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._executor(), functools.partial(spec.func, **arguments))
+
+        if spec.output_validator is not None:
+            if not isinstance(result, dict):
+                raise ValueError(f"Output validation error: {name} returned no structured output")
+            if not spec.output_validator.is_valid(result):
+                error = best_match(spec.output_validator.iter_errors(result))
+                raise ValueError(f"Output validation error: {error.message}")
+        return result
+
+    async def call_tool_result(self, name: str, arguments: Optional[dict] = None) -> types.CallToolResult:
+        """Run a tool and wrap its result for the MCP call_tool handler.
+
+        The SDK passes a returned CallToolResult through as-is (mcp >= 1.19),
+        which skips its own per-call output validation.
+        """
+        try:
+            result = await self.call(name, arguments)
+        except Exception as e:
+            logger.error(f"❌ Tool {name} failed: {e}")
+            return types.CallToolResult(content=[types.TextContent(type="text", text=str(e))], isError=True)
+
+        structured = None
+        if isinstance(result, dict):
+            structured = result
+            content = [types.TextContent(type="text", text=json.dumps(result))]
+        elif isinstance(result, str):
+            content = [types.TextContent(type="text", text=result)]
+        elif isinstance(result, (list, tuple)):
+            content = list(result)
+        else:
+            content = [result]
+        return types.CallToolResult(content=content, structuredContent=structured, isError=False)
@@ -1,11 +1,20 @@
 from fastapi import FastAPI, Request, Form
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 import logging
 import os
 import re
+import json
+import zlib
+import hashlib
 import asyncio
+from contextlib import asynccontextmanager
 from dataclasses import dataclass
-import requests
+import cassette
+
+try:
+    import zstandard
+except ImportError:  # optional: gzip is used when zstd isn't available
+    zstandard = None
 
 # import the server module (our handlers)
 import importlib.util
@@ -21,7 +30,24 @@ fh = logging.FileHandler(os.path.join(log_dir, "webui.log"))
 fh.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
 logger.addHandler(fh)
 
-app = FastAPI()
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "8"))
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "1000"))
+# a JSON array body is only parsed once complete, so the body size bounds that parse
+BULK_MAX_BODY_BYTES = int(os.getenv("BULK_MAX_BODY_BYTES", str(10 * 1024 * 1024)))
+BULK_MAX_LINE_BYTES = int(os.getenv("BULK_MAX_LINE_BYTES", str(1024 * 1024)))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if os.getenv("PREFETCH_ENABLED", "true").lower() in ("1", "true", "yes"):
+        mod.start_prefetcher()
+    try:
+        yield
+    finally:
+        mod.prefetcher.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 def _call_liara(prompt: str) -> str:
     """Call Liara AI API and return text response."""
@@ -46,7 +72,7 @@ def _call_liara(prompt: str) -> str:
     }
 
     try:
-        r = requests.post(f"{LIARA_BASE_URL}/chat/completions", headers=headers, json=payload, timeout=20)
+        r = cassette.post(f"{LIARA_BASE_URL}/chat/completions", headers=headers, json=payload, timeout=20)
         r.raise_for_status()
         data = r.json()
         
@@ -95,11 +121,12 @@ def _parse_mul(prompt: str):
     return None
 
 
-@app.post("/api/ask")
-async def api_ask(request: Request, prompt: str = Form(...)):
-    # detect multiply intent (Persian 'ضرب' or pattern)
+async def _answer(prompt: str):
+    """Answer one prompt; returns (payload, status_code)."""
     logger.info("Prompt received: %s", prompt)
+    loop = asyncio.get_running_loop()
 
+    # detect multiply intent (Persian 'ضرب' or pattern)
     if "ضرب" in prompt or "multiply" in prompt or _parse_mul(prompt):
         parsed = _parse_mul(prompt)
         if parsed:
@@ -110,38 +137,308 @@ async def api_ask(request: Request, prompt: str = Form(...)):
                 a, b = float(nums[0]), float(nums[1])
             else:
                 logger.info("Multiply intent but numbers not found")
-                return JSONResponse({"error": "numbers not found for multiply"}, status_code=400)
+                return {"error": "numbers not found for multiply"}, 400
 
         logger.info("Calling math_op for multiply %s * %s", a, b)
         try:
             # call the async math_op
-            res = await mod.math_op("math_op", {"operation": "mul", "a": a, "b": b})
+            res = await mod.math_op("mul", a, b)
             logger.info("math_op result: %s", res)
-            return JSONResponse({"result": res})
+            return {"result": res}, 200
         except Exception as e:
             logger.exception("math_op failed")
-            return JSONResponse({"error": str(e)}, status_code=500)
+            return {"error": str(e)}, 500
 
     # otherwise use Liara AI if configured, else fallback to server completion
     try:
         try:
             logger.info("Forwarding prompt to Liara AI")
-            text = _call_liara(prompt)
+            text = await loop.run_in_executor(None, _call_liara, prompt)
             logger.info("Liara AI returned: %s", text)
-            return JSONResponse({"completion": [text]})
+            return {"completion": [text]}, 200
         except Exception as e:
             logger.exception("Liara AI call failed, falling back to internal completion: %s", e)
 
         arg = MockArg(text=prompt)
-        loop = asyncio.get_running_loop()
         def call_completion():
             return mod.provide_completion(None, arg, None)
 
         res = await loop.run_in_executor(None, call_completion)
         logger.info("Internal completion returned: %s", res)
         if not res:
-            return JSONResponse({"result": None})
-        return JSONResponse({"completion": res.values})
-    except Exception as e:
+            return {"result": None}, 200
+        return {"completion": res.values}, 200
+    except Exception:
         logger.exception("LLM call failed")
-        return JSONResponse({"error": str(e)}, status_code=500)
+        return {"error": "completion failed"}, 500
+
+
+@app.post("/api/ask")
+async def api_ask(request: Request, prompt: str = Form(...)):
+    payload, status = await _answer(prompt)
+    return JSONResponse(payload, status_code=status)
+
+
+def _price_result(ticker: str):
+    """Cached prev-close data for ticker with its ETag and remaining freshness."""
+    data = mod.cached_prev(ticker)
+    body = json.dumps(data, sort_keys=True, separators=(",", ":"))
+    etag = '"' + hashlib.sha1(body.encode("utf-8")).hexdigest() + '"'
+    max_age = max(0, int(mod.price_cache.expires_in(("prev", ticker))))
+    return data, etag, f"public, max-age={max_age}"
+
+
+@app.get("/api/price/{ticker}")
+async def api_price(ticker: str, request: Request):
+    loop = asyncio.get_running_loop()
+    try:
+        data, etag, cache_control = await loop.run_in_executor(None, _price_result, ticker)
+    except Exception:
+        # upstream errors may carry request details; keep them in the log only
+        logger.exception("Price lookup failed for %s", ticker)
+        return JSONResponse({"error": "upstream price lookup failed"}, status_code=502)
+
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse({"ticker": ticker, "data": data}, headers=headers)
+
+
+async def _run_tool(tool: str, arguments: dict):
+    """Run a tool request from a bulk item; returns (payload, status_code)."""
+    if not isinstance(tool, str):
+        return {"error": "tool must be a string"}, 400
+    if arguments is None:
+        arguments = {}
+    if not isinstance(arguments, dict):
+        return {"error": "arguments must be a JSON object"}, 400
+    if tool == "get_price":
+        ticker = arguments.get("ticker")
+        if not ticker:
+            return {"error": "ticker is required"}, 400
+        loop = asyncio.get_running_loop()
+        try:
+            data, etag, cache_control = await loop.run_in_executor(None, _price_result, ticker)
+        except Exception:
+            logger.exception("Price lookup failed for %s", ticker)
+            return {"error": "upstream price lookup failed"}, 502
+        return {"ticker": ticker, "data": data, "etag": etag, "cache_control": cache_control}, 200
+    try:
+        result = await mod.registry.call(tool, arguments)
+    except ValueError as e:
+        # unknown tool, invalid arguments or a rejected operation
+        return {"error": str(e)}, 400
+    return {"result": getattr(result, "text", result)}, 200
+
+
+async def _bulk_item(index: int, item):
+    """Process one bulk item into a result line (never raises)."""
+    item_id = item.get("id", index) if isinstance(item, dict) else index
+    try:
+        if not isinstance(item, dict):
+            payload, status = {"error": "item must be a JSON object"}, 400
+        elif "prompt" in item:
+            payload, status = await _answer(str(item["prompt"]))
+        elif "tool" in item:
+            payload, status = await _run_tool(item["tool"], item.get("arguments"))
+        else:
+            payload, status = {"error": "item needs 'prompt' or 'tool'"}, 400
+    except Exception:
+        logger.exception("Bulk item %s failed", item_id)
+        payload, status = {"error": "internal error"}, 500
+    return {"id": item_id, "status": status, **payload}
+
+
+class _BodyTooLarge(Exception):
+    """The bulk body or one of its NDJSON lines is over the configured limit."""
+
+
+async def _iter_bulk_items(request: Request):
+    """Yield items from a JSON array body or an NDJSON stream as lines arrive."""
+    buf = bytearray()
+    total = 0
+    is_array = None
+    async for chunk in request.stream():
+        total += len(chunk)
+        if total > BULK_MAX_BODY_BYTES:
+            raise _BodyTooLarge(f"bulk body exceeds {BULK_MAX_BODY_BYTES} bytes")
+        buf += chunk
+        if is_array is None:
+            head = buf.lstrip()
+            if not head:
+                continue
+            is_array = head.startswith(b"[")
+        if is_array:
+            continue
+        start = 0
+        while True:
+            end = buf.find(b"\n", start)
+            if end == -1:
+                break
+            if end - start > BULK_MAX_LINE_BYTES:
+                raise _BodyTooLarge(f"bulk line exceeds {BULK_MAX_LINE_BYTES} bytes")
+            line = bytes(buf[start:end])
+            start = end + 1
+            if line.strip():
+                yield json.loads(line)
+        del buf[:start]
+        if len(buf) > BULK_MAX_LINE_BYTES:
+            raise _BodyTooLarge(f"bulk line exceeds {BULK_MAX_LINE_BYTES} bytes")
+
+    if is_array:
+        items = json.loads(buf)
+        for item in items:
+            yield item
+    elif buf.strip():
+        yield json.loads(buf)
+
+
+class _StreamEncoder:
+    """Incremental gzip/zstd encoder that can flush after each batch of lines."""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "zstd":
+            self._obj = zstandard.ZstdCompressor().compressobj()
+        elif encoding == "gzip":
+            self._obj = zlib.compressobj(wbits=31)
+        else:
+            self._obj = None
+
+    def write(self, data: bytes) -> bytes:
+        return self._obj.compress(data) if self._obj else data
+
+    def flush(self) -> bytes:
+        if self.encoding == "zstd":
+            return self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        if self.encoding == "gzip":
+            return self._obj.flush(zlib.Z_SYNC_FLUSH)
+        return b""
+
+    def close(self) -> bytes:
+        return self._obj.flush() if self._obj else b""
+
+
+def _pick_encoding(accept_encoding: str) -> str:
+    """Pick the highest-q coding we support; q=0 marks a coding as refused."""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name.strip():
+            accepted[name.strip().lower()] = q
+    best, best_q = "identity", 0.0
+    # on equal q, zstd wins over gzip
+    for name in (["zstd"] if zstandard is not None else []) + ["gzip"]:
+        q = accepted.get(name, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+@app.post("/api/bulk")
+async def api_bulk(request: Request):
+    """Run many prompts/tool calls concurrently and stream results as NDJSON.
+
+    The body is a JSON array or NDJSON, one item per element/line:
+    ``{"id": ..., "prompt": "..."}`` or
+    ``{"id": ..., "tool": "get_price", "arguments": {"ticker": "AAPL"}}``.
+    Results are streamed in completion order, each tagged with its ``id``.
+    Bodies over BULK_MAX_BODY_BYTES, or NDJSON lines over BULK_MAX_LINE_BYTES,
+    get a 413 before anything is streamed.
+    """
+    try:
+        declared = int(request.headers.get("content-length", "0"))
+    except ValueError:
+        declared = 0
+    if declared > BULK_MAX_BODY_BYTES:
+        return JSONResponse({"error": f"bulk body exceeds {BULK_MAX_BODY_BYTES} bytes"}, status_code=413)
+
+    encoding = _pick_encoding(request.headers.get("accept-encoding", ""))
+    results: asyncio.Queue = asyncio.Queue()
+    sem = asyncio.Semaphore(BULK_CONCURRENCY)
+
+    async def run(index, item):
+        try:
+            await results.put(await _bulk_item(index, item))
+        finally:
+            sem.release()
+
+    body_read = asyncio.Event()
+    too_large = None
+
+    async def produce():
+        nonlocal too_large
+        tasks = []
+        try:
+            try:
+                index = 0
+                async for item in _iter_bulk_items(request):
+                    if index >= BULK_MAX_ITEMS:
+                        await results.put({"id": None, "status": 413, "error": f"more than {BULK_MAX_ITEMS} items; rest ignored"})
+                        break
+                    # acquiring before spawning bounds in-flight work and backpressures the reader
+                    await sem.acquire()
+                    tasks.append(asyncio.create_task(run(index, item)))
+                    index += 1
+            except (ValueError, TypeError) as e:
+                await results.put({"id": None, "status": 400, "error": f"invalid bulk body: {e}"})
+            except _BodyTooLarge as e:
+                too_large = str(e)
+            finally:
+                body_read.set()
+            await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            # client went away; drop the work still in flight
+            for t in tasks:
+                t.cancel()
+            raise
+        finally:
+            await results.put(None)
+
+    # Items start running while the body is still arriving. Streaming only
+    # begins once it is fully read: StreamingResponse watches the same
+    # receive channel for disconnects, so the body can't be read after that.
+    producer = asyncio.create_task(produce())
+    try:
+        await body_read.wait()
+    except asyncio.CancelledError:
+        producer.cancel()
+        raise
+    if too_large:
+        # nothing has been streamed yet, so the whole request can still fail
+        producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
+        return JSONResponse({"error": too_large}, status_code=413)
+
+    async def stream():
+        encoder = _StreamEncoder(encoding)
+        try:
+            while True:
+                result = await results.get()
+                if result is None:
+                    break
+                line = json.dumps(result, ensure_ascii=False, separators=(",", ":")) + "\n"
+                out = encoder.write(line.encode("utf-8"))
+                # flush once per batch of ready results rather than once per line
+                if results.empty():
+                    out += encoder.flush()
+                if out:
+                    yield out
+            yield encoder.close()
+        finally:
+            producer.cancel()
+
+    headers = {"Cache-Control": "no-store"}
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+        headers["Vary"] = "Accept-Encoding"
+    logger.info("Bulk request started (encoding=%s)", encoding)
+    return StreamingResponse(stream(), media_type="application/x-ndjson", headers=headers)